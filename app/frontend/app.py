@@ -1,6 +1,7 @@
 #app.py
 import streamlit as st
 import requests
+from requests_toolbelt.multipart.encoder import MultipartEncoder
 import os
 from pathlib import Path
 
@@ -8,6 +9,7 @@ BACKEND_URL = "http://localhost:8000"
 LOGIN_URL = f"{BACKEND_URL}/login"
 CHAT_URL = f"{BACKEND_URL}/chat"
 UPLOAD_URL = f"{BACKEND_URL}/upload"
+UPLOAD_BATCH_URL = f"{BACKEND_URL}/upload/batch"
 
 st.set_page_config(page_title="Enterprise RAG System", layout="wide")
 
@@ -91,38 +93,52 @@ else:
 
             if st.button("Process and Index Documents"):
                 if uploaded_files:
-                    progress_bar = st.progress(0)
                     status_text = st.empty()
+                    status_text.text(f"Uploading {len(uploaded_files)} documents...")
 
-                    total_files = len(uploaded_files)
-
-                    for idx, uploaded_file in enumerate(uploaded_files):
-                        status_text.text(f"Processing {uploaded_file.name}...")
-
-                        try:
-                            files = {
-                                'file': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)
-                            }
-                            data = {'department': department}
-
+                    try:
+                        # Send the whole selection in one multipart request; the encoder streams
+                        # the body from the file objects instead of building it in memory
+                        encoder = MultipartEncoder(fields=[('department', department)] + [
+                            ('files', (uploaded_file.name, uploaded_file, uploaded_file.type))
+                            for uploaded_file in uploaded_files
+                        ])
+
+                        with st.spinner("Processing and indexing..."):
                             response = requests.post(
-                                UPLOAD_URL,
-                                files=files,
-                                data=data,
+                                UPLOAD_BATCH_URL,
+                                data=encoder,
+                                headers={'Content-Type': encoder.content_type},
                                 auth=(st.session_state.username, st.session_state.password)
                             )
 
-                            if response.status_code == 200:
-                                st.success(f"✅ Processed: {uploaded_file.name}")
+                        if response.status_code == 200:
+                            counts = {"processed": 0, "duplicate": 0, "failed": 0}
+                            for result in response.json()["results"]:
+                                name = result["filename"]
+                                if result["status"] in ("indexed", "saved"):
+                                    counts["processed"] += 1
+                                    st.success(f"✅ Processed: {name}")
+                                elif result["status"] == "duplicate":
+                                    counts["duplicate"] += 1
+                                    st.info(f"ℹ️ Skipped (already ingested): {name}")
+                                else:
+                                    counts["failed"] += 1
+                                    st.error(f"❌ {name}: {result.get('detail', 'Upload failed')}")
+
+                            summary = (f"{counts['processed']} processed, {counts['duplicate']} skipped as duplicates, "
+                                       f"{counts['failed']} failed")
+                            if counts["failed"]:
+                                status_text.text(f"⚠️ Finished with errors: {summary}")
                             else:
-                                st.error(f"❌ Error: {response.json().get('detail', 'Upload failed')}")
-
-                        except Exception as e:
-                            st.error(f"❌ Error processing {uploaded_file.name}: {e}")
-
-                        progress_bar.progress((idx + 1) / total_files)
+                                status_text.text(f"✅ Finished: {summary}")
+                        else:
+                            st.error(f"❌ Error: {response.json().get('detail', 'Upload failed')}")
+                            status_text.empty()
 
-                    status_text.text("✅ All documents processed successfully!")
+                    except Exception as e:
+                        st.error(f"❌ Error processing documents: {e}")
+                        status_text.empty()
                 else:
                     st.warning("Please upload at least one document")
 
@@ -1,14 +1,37 @@
 #main.py
-from typing import Dict
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
+from typing import Dict, List
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel
 import os
 from pathlib import Path
 import shutil
-from app.services.rag_service import rag_answer
+import json
+import math
+import weakref
+from app.services.rag_service import rag_answer, rag_answer_batch
+from app.services.llm_scheduler import (
+    BATCH,
+    CHAT_REQUESTS_ESTIMATE,
+    COMPLETION_TOKENS_ESTIMATE,
+    INTERACTIVE,
+    LLMOverloadedError,
+    estimate_tokens,
+    scheduler,
+)
 from app.services.document_processor import process_document, save_as_markdown
-from scripts.index_data import index_documents
+from app.services.ingestion import (
+    MAX_BATCH_BYTES,
+    MAX_UPLOAD_BYTES,
+    MULTIPART_OVERHEAD_BYTES,
+    UploadTooLargeError,
+    copy_upload_to_disk,
+    is_ingested,
+    record_ingested,
+)
+from app.services.index_writer import get_index_version, index_write_lock, submit_indexing
 
 app = FastAPI()
 security = HTTPBasic()
@@ -22,6 +45,9 @@ USERS_DB: Dict[str, Dict[str, str]] = {
     "Natasha": {"password": "hrpass123", "role": "hr"}
 }
 
+MAX_BATCH_QUESTIONS = 500
+BATCH_CHAT_CONCURRENCY = 4
+
 UPLOAD_BASE_DIR = "./uploaded_documents"
 MARKDOWN_BASE_DIR = "./markdown_documents"
 
@@ -36,6 +62,35 @@ def authenticate(credentials: HTTPBasicCredentials = Depends(security)):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     return {"username": username, "role": user["role"]}
 
+# Reject oversized uploads from the headers, before Starlette spools the body to disk
+UPLOAD_REQUEST_LIMITS = {
+    "/upload": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+    "/upload/batch": MAX_BATCH_BYTES + MULTIPART_OVERHEAD_BYTES,
+}
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    limit = UPLOAD_REQUEST_LIMITS.get(request.url.path)
+    if request.method == "POST" and limit is not None:
+        content_length = request.headers.get("content-length")
+        if content_length is None:
+            return JSONResponse(status_code=411, content={"detail": "Content-Length header is required for uploads"})
+        if not content_length.isdigit():
+            return JSONResponse(status_code=400, content={"detail": "Invalid Content-Length header"})
+        if int(content_length) > limit:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Upload exceeds the {limit // (1024 * 1024)} MiB request limit"}
+            )
+    return await call_next(request)
+
+def overloaded(e: LLMOverloadedError) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=str(e),
+        headers={"Retry-After": str(math.ceil(e.retry_after))}
+    )
+
 @app.get("/login")
 def login(user=Depends(authenticate)):
     return {"message": f"Welcome {user['username']}!", "role": user["role"]}
@@ -44,15 +99,76 @@ def login(user=Depends(authenticate)):
 def test(user=Depends(authenticate)):
     return {"message": f"Hello {user['username']}! You can now chat.", "role": user["role"]}
 
+@app.get("/index/version")
+def index_version(user=Depends(authenticate)):
+    # Cheap to poll: bumps whenever any worker writes to the index
+    return {"version": get_index_version()}
+
 class ChatRequest(BaseModel):
     message: str
 
 @app.post("/chat")
-def chat(req: ChatRequest, user=Depends(authenticate)):
+async def chat(req: ChatRequest, user=Depends(authenticate)):
     role = user["role"]
-    answer = rag_answer(req.message, role)
+    # Admission runs on the event loop, before a threadpool thread is taken,
+    # so a burst is rejected with 429 instead of queueing behind the threadpool
+    try:
+        reservation = scheduler.admit(
+            INTERACTIVE,
+            CHAT_REQUESTS_ESTIMATE,
+            estimate_tokens(req.message) + COMPLETION_TOKENS_ESTIMATE
+        )
+    except LLMOverloadedError as e:
+        raise overloaded(e)
+    try:
+        answer = await run_in_threadpool(rag_answer, req.message, role, user=user["username"])
+    finally:
+        scheduler.finish(reservation)
     return {"answer": answer}
 
+class BatchChatRequest(BaseModel):
+    messages: List[str]
+
+@app.post("/chat/batch")
+async def chat_batch(req: BatchChatRequest, user=Depends(authenticate)):
+    if not req.messages:
+        raise HTTPException(status_code=400, detail="No messages provided")
+    if len(req.messages) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUESTIONS} messages per batch")
+
+    role = user["role"]
+    # The whole batch is admitted up front; once streaming, its questions wait for budget
+    try:
+        reservation = scheduler.admit(
+            BATCH,
+            CHAT_REQUESTS_ESTIMATE * len(req.messages),
+            estimate_tokens(*req.messages) + COMPLETION_TOKENS_ESTIMATE * len(req.messages)
+        )
+    except LLMOverloadedError as e:
+        raise overloaded(e)
+
+    # Embedding and retrieval happen here, before the 200 status is sent
+    try:
+        answers = await run_in_threadpool(rag_answer_batch, req.messages, role,
+                                          max_concurrency=BATCH_CHAT_CONCURRENCY, user=user["username"])
+    except Exception as e:
+        scheduler.finish(reservation)
+        raise HTTPException(status_code=500, detail=f"Error retrieving documents: {str(e)}")
+
+    # Stream one NDJSON line per answer as soon as it completes
+    def stream_answers():
+        try:
+            for index, message, answer, error in answers:
+                yield json.dumps({"index": index, "message": message, "answer": answer, "error": error}) + "\n"
+        finally:
+            answers.close()
+            release()
+
+    stream = stream_answers()
+    # Runs once: when the stream ends, or when it is dropped without ever being iterated
+    release = weakref.finalize(stream, scheduler.finish, reservation)
+    return StreamingResponse(stream, media_type="application/x-ndjson")
+
 @app.post("/upload")
 async def upload_document(file: UploadFile = File(...), department: str = Form(...), user=Depends(authenticate)):
     if user["role"] != "c-level":
@@ -86,7 +202,8 @@ async def upload_document(file: UploadFile = File(...), department: str = Form(.
         metadata = {"department": department, "original_filename": file.filename, "uploaded_by": user["username"]}
         save_as_markdown(text_content, md_path, metadata)
 
-        index_documents(MARKDOWN_BASE_DIR)
+        # Waits on the cross-process writer lock and LLM budget; keep it off the event loop
+        await run_in_threadpool(submit_indexing, MARKDOWN_BASE_DIR)
 
         return {
             "message": "Document processed and indexed successfully",
@@ -96,3 +213,118 @@ async def upload_document(file: UploadFile = File(...), department: str = Form(.
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
+
+def publish_batch(department, staged_tables, table_entries, md_to_index, doc_entries):
+    """
+    Publish a batch as the index writer, so snapshot exports never see tables
+    or manifest entries without the chunks they belong to (or the reverse).
+    One indexing pass covers every new document in the batch.
+    """
+    with index_write_lock(bump_version=False):
+        for tmp_path, upload_path in staged_tables:
+            os.replace(tmp_path, upload_path)
+        if table_entries:
+            record_ingested(department, table_entries)
+        if md_to_index:
+            # Reenters the writer lock and bumps the index version
+            submit_indexing(MARKDOWN_BASE_DIR, md_to_index)
+            record_ingested(department, doc_entries)
+
+@app.post("/upload/batch")
+async def upload_documents_batch(files: List[UploadFile] = File(...), department: str = Form(...), user=Depends(authenticate)):
+    if user["role"] != "c-level":
+        raise HTTPException(status_code=403, detail="Only c-level users can upload documents")
+
+    department = department.lower()
+    dept_upload_dir = os.path.join(UPLOAD_BASE_DIR, department)
+    dept_markdown_dir = os.path.join(MARKDOWN_BASE_DIR, department)
+    os.makedirs(dept_upload_dir, exist_ok=True)
+    os.makedirs(dept_markdown_dir, exist_ok=True)
+
+    results = []
+    md_to_index = []
+    doc_entries = []
+    staged_tables = []
+    table_entries = []
+    seen_hashes = set()
+    batch_targets = set()
+    batch_bytes = 0
+
+    for file in files:
+        filename = Path(file.filename).name
+        upload_path = os.path.join(dept_upload_dir, filename)
+
+        try:
+            sha256, size, tmp_path = await copy_upload_to_disk(file, upload_path)
+        except UploadTooLargeError as e:
+            results.append({"filename": filename, "status": "rejected", "detail": str(e)})
+            continue
+        except Exception as e:
+            results.append({"filename": filename, "status": "error", "detail": f"Error saving file: {str(e)}"})
+            continue
+        finally:
+            await file.close()
+
+        # ✅ Skip content already ingested for this department (or repeated within the batch)
+        if sha256 in seen_hashes or is_ingested(department, sha256):
+            os.remove(tmp_path)
+            results.append({"filename": filename, "status": "duplicate", "sha256": sha256})
+            continue
+
+        ext = Path(filename).suffix.lower()
+        is_table = ext in [".csv", ".xlsx", ".xls"]
+        md_path = None if is_table else os.path.join(dept_markdown_dir, Path(filename).stem + ".md")
+
+        # Two files in one batch must not write the same upload or markdown path (e.g. report.pdf + report.docx)
+        targets = {upload_path} if is_table else {upload_path, md_path}
+        if targets & batch_targets:
+            os.remove(tmp_path)
+            results.append({
+                "filename": filename,
+                "status": "rejected",
+                "detail": "Another file in this batch has the same name; rename it and upload it separately"
+            })
+            continue
+
+        if batch_bytes + size > MAX_BATCH_BYTES:
+            os.remove(tmp_path)
+            results.append({"filename": filename, "status": "rejected", "detail": "Batch size limit exceeded"})
+            continue
+
+        seen_hashes.add(sha256)
+        batch_targets |= targets
+        batch_bytes += size
+        entry = {"sha256": sha256, "filename": filename, "size": size, "uploaded_by": user["username"]}
+
+        if is_table:
+            # ✅ Save raw CSV/Excel only, Pandas agent will pick it up once published below
+            staged_tables.append((tmp_path, upload_path))
+            table_entries.append(entry)
+            results.append({"filename": filename, "status": "saved", "sha256": sha256})
+            continue
+
+        os.replace(tmp_path, upload_path)
+
+        try:
+            text_content = await run_in_threadpool(process_document, upload_path)
+            metadata = {"department": department, "original_filename": filename, "uploaded_by": user["username"]}
+            save_as_markdown(text_content, md_path, metadata)
+        except Exception as e:
+            results.append({"filename": filename, "status": "error", "detail": f"Error processing document: {str(e)}"})
+            continue
+
+        md_to_index.append(md_path)
+        doc_entries.append(entry)
+        results.append({"filename": filename, "status": "indexed", "sha256": sha256})
+
+    if staged_tables or md_to_index:
+        try:
+            await run_in_threadpool(publish_batch, department, staged_tables, table_entries, md_to_index, doc_entries)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error indexing documents: {str(e)}")
+
+    return {
+        "message": f"Processed {len(files)} files, indexed {len(md_to_index)}",
+        "department": department,
+        "results": results
+    }
@@ -0,0 +1,71 @@
+#index_writer.py
+import os
+from contextlib import contextmanager
+
+from filelock import FileLock
+
+from scripts.index_data import index_documents
+
+# Every uvicorn worker shares ./chroma_db. Writes go through a single
+# cross-process lock so only one worker indexes at a time, and each write bumps
+# a version counter that readers poll to know when to reopen their handles.
+INDEX_LOCK_PATH = "./chroma_db.lock"
+INDEX_VERSION_PATH = "./chroma_db.version"
+INDEX_LOCK_TIMEOUT = 600  # seconds to wait for the writer role
+
+_write_lock = FileLock(INDEX_LOCK_PATH, timeout=INDEX_LOCK_TIMEOUT)
+
+
+def get_index_version() -> int:
+    """Return the current index version (0 if nothing was written yet)"""
+    try:
+        with open(INDEX_VERSION_PATH, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def _bump_index_version() -> int:
+    """Increment the index version; must be called while holding the write lock"""
+    version = get_index_version() + 1
+    tmp_path = INDEX_VERSION_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(version))
+    os.replace(tmp_path, INDEX_VERSION_PATH)
+    return version
+
+
+@contextmanager
+def index_write_lock(bump_version: bool = True):
+    """
+    Hold the single-writer role for ./chroma_db.
+    The index version is bumped when the block exits without error, unless
+    bump_version is False (read-only holders such as snapshot export).
+    """
+    with _write_lock:
+        yield
+        if bump_version:
+            version = _bump_index_version()
+            print(f"🔖 Index version is now {version}")
+
+
+def submit_indexing(docs_dir, md_files=None) -> int:
+    """
+    Run index_documents as the single writer and return the new index version.
+    Blocks until any other worker's write has finished.
+    """
+    with index_write_lock():
+        index_documents(docs_dir, md_files)
+        rebuild_numpy_index_if_enabled()
+    return get_index_version()
+
+
+def rebuild_numpy_index_if_enabled():
+    """
+    Publish a fresh memory-mapped index before readers see the new version.
+    Call while holding index_write_lock after any write to ./chroma_db; the
+    build is stamped with the version the lock publishes when it exits.
+    """
+    if os.getenv("RETRIEVER_BACKEND", "chroma").lower() == "numpy":
+        from app.services.retrievers import ChromaRetriever, build_numpy_index
+        build_numpy_index(ChromaRetriever().collection, index_version=get_index_version() + 1)
@@ -0,0 +1,113 @@
+#ingestion.py
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+from filelock import FileLock
+
+# Manifest of every file whose content has been ingested, keyed by department
+# and SHA-256 of the raw upload, so re-uploads of the same bytes are skipped.
+MANIFEST_PATH = "./ingestion_manifest.json"
+
+# Copy / size limits for uploads
+UPLOAD_CHUNK_SIZE = 1024 * 1024          # 1 MiB per read
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024      # 50 MiB per file
+MAX_BATCH_BYTES = 500 * 1024 * 1024      # 500 MiB per batch request
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024   # headroom for multipart boundaries and form fields
+
+# Shared by all uvicorn workers, so guard it with a file lock
+_manifest_lock = FileLock(MANIFEST_PATH + ".lock")
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit"""
+
+
+# -------------------- Manifest --------------------
+def load_manifest(path: str = MANIFEST_PATH) -> dict:
+    """Load the ingestion manifest ({department: {sha256: entry}})"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"⚠️  Could not read ingestion manifest {path}: {e}")
+        return {}
+
+
+def save_manifest(manifest: dict, path: str = MANIFEST_PATH):
+    """Atomically write the ingestion manifest"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def is_ingested(department: str, sha256: str, path: str = MANIFEST_PATH) -> bool:
+    """Check whether a content hash was already ingested for a department"""
+    with _manifest_lock:
+        manifest = load_manifest(path)
+    return sha256 in manifest.get(department.lower(), {})
+
+
+def record_ingested(department: str, entries: list, path: str = MANIFEST_PATH):
+    """
+    Record ingested files for a department
+    Each entry is a dict with at least 'sha256' and 'filename'
+    A new version of a file replaces the previous hash recorded for that filename,
+    so re-uploading an older version is not skipped as a duplicate
+    """
+    if not entries:
+        return
+    ingested_at = datetime.now(timezone.utc).isoformat()
+    with _manifest_lock:
+        manifest = load_manifest(path)
+        dept_entries = manifest.setdefault(department.lower(), {})
+        for entry in entries:
+            for sha256 in [sha for sha, info in dept_entries.items()
+                           if info.get("filename") == entry["filename"] and sha != entry["sha256"]]:
+                del dept_entries[sha256]
+            dept_entries[entry["sha256"]] = {
+                **{k: v for k, v in entry.items() if k != "sha256"},
+                "ingested_at": ingested_at,
+            }
+        save_manifest(manifest, path)
+
+
+# -------------------- Upload copy --------------------
+async def copy_upload_to_disk(upload_file, dest_path: str, max_bytes: int = MAX_UPLOAD_BYTES) -> tuple:
+    """
+    Copy an UploadFile to disk in chunks while computing its SHA-256.
+    Starlette has already spooled the request body, so the request size itself
+    is limited by the Content-Length check in main.py; this enforces the
+    per-file limit and hashes without holding the file in memory.
+    The file is written to '<dest_path>.part'; the caller moves it into place
+    (or discards it, e.g. for duplicates). Returns (sha256_hex, size, tmp_path).
+    Raises UploadTooLargeError if the file exceeds max_bytes.
+    """
+    if upload_file.size is not None and upload_file.size > max_bytes:
+        raise UploadTooLargeError(f"{upload_file.filename} exceeds the {max_bytes // (1024 * 1024)} MiB limit")
+
+    tmp_path = dest_path + ".part"
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as buffer:
+            while True:
+                chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(
+                        f"{upload_file.filename} exceeds the {max_bytes // (1024 * 1024)} MiB limit"
+                    )
+                hasher.update(chunk)
+                buffer.write(chunk)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return hasher.hexdigest(), size, tmp_path
@@ -0,0 +1,257 @@
+#llm_scheduler.py
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from langchain_core.rate_limiters import BaseRateLimiter
+
+# Every OpenAI / LangChain call goes through one scheduler per process.
+# Budgets are per process: with N uvicorn workers, set them to the account limit / N.
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "200000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Work is admitted only while its estimated wait for budget stays under this
+LLM_MAX_WAIT_SECONDS = float(os.getenv("LLM_MAX_WAIT_SECONDS", "30"))
+# Rough duration of one OpenAI call, used to estimate the wait from the concurrency cap
+CALL_SECONDS_ESTIMATE = 3.0
+
+# Rough completion size reserved for chat calls; corrected from response.usage afterwards
+COMPLETION_TOKENS_ESTIMATE = 1000
+AGENT_CALL_TOKENS_ESTIMATE = 2000
+# OpenAI calls reserved at admission for one chat question (embedding + answer)
+CHAT_REQUESTS_ESTIMATE = 2
+
+# Priorities, lower runs first
+INTERACTIVE = 0
+BATCH = 1
+BACKGROUND = 2
+
+_current_user = ContextVar("llm_user", default="system")
+_current_priority = ContextVar("llm_priority", default=BACKGROUND)
+
+
+class LLMOverloadedError(Exception):
+    """Raised when admitting more work would exceed the wait limit; retry_after is a hint in seconds"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM capacity is exhausted, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+@contextmanager
+def llm_context(user: str, priority: int):
+    """Attribute LLM calls made in this block to a user and priority"""
+    user_token = _current_user.set(user)
+    priority_token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_user.reset(user_token)
+        _current_priority.reset(priority_token)
+
+
+def estimate_tokens(*texts) -> int:
+    """Cheap token estimate (~4 characters per token)"""
+    return sum(len(text) for text in texts) // 4 + 1
+
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 per second, bursting up to one minute's budget"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be consumed (0 if available now)"""
+        self._refill()
+        deficit = min(amount, self.capacity) - self.level
+        return max(0.0, deficit / self.rate)
+
+    def consume(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def backlog_time(self, amount: float) -> float:
+        """Seconds to refill enough for amount, which may exceed the burst capacity"""
+        self._refill()
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def adjust(self, delta: float):
+        """Charge (or refund) the difference between actual and estimated usage"""
+        self._refill()
+        self.level = min(self.capacity, self.level - delta)
+
+
+class _Ticket:
+    __slots__ = ("priority", "user", "tokens")
+
+    def __init__(self, priority, user, tokens):
+        self.priority = priority
+        self.user = user
+        self.tokens = tokens
+
+
+class LLMScheduler:
+    """
+    Admission control for LLM calls.
+    Requests and tokens are budgeted with token buckets, concurrency is capped,
+    lower priorities only run when no higher-priority work is waiting, and
+    within a priority users are served round-robin so one user's burst cannot
+    starve the others.
+    Endpoints reserve their estimated calls with admit() before doing any work;
+    work whose estimated wait behind already-admitted work at the same or
+    higher priority exceeds max_wait is rejected with LLMOverloadedError.
+    Once admitted (and for background work, which is never admitted) calls
+    wait for their turn instead of failing partway through.
+    """
+
+    def __init__(self, requests_per_minute: int = OPENAI_RPM, tokens_per_minute: int = OPENAI_TPM,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, max_wait: float = LLM_MAX_WAIT_SECONDS):
+        self._cond = threading.Condition()
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._max_concurrency = max_concurrency
+        self._max_wait = max_wait
+        self._active = 0
+        # priority -> {user: deque of tickets}; dict order is the round-robin order
+        self._queues = {priority: OrderedDict() for priority in (INTERACTIVE, BATCH, BACKGROUND)}
+        # priority -> [requests, tokens] reserved by admitted, unfinished work
+        self._reserved = {priority: [0, 0] for priority in (INTERACTIVE, BATCH, BACKGROUND)}
+
+    def _estimated_wait(self, priority: int) -> float:
+        """Seconds until admitted work at this or a higher priority has drained"""
+        requests = sum(r for p, (r, _) in self._reserved.items() if p <= priority)
+        tokens = sum(t for p, (_, t) in self._reserved.items() if p <= priority)
+        return max(
+            self._requests.backlog_time(requests),
+            self._tokens.backlog_time(tokens),
+            requests / self._max_concurrency * CALL_SECONDS_ESTIMATE,
+        )
+
+    def _head(self):
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if users:
+                return next(iter(users.values()))[0]
+        return None
+
+    def _remove(self, ticket):
+        users = self._queues[ticket.priority]
+        queue = users.pop(ticket.user)
+        queue.remove(ticket)
+        # Round-robin: a served user moves to the back of its priority class
+        if queue:
+            users[ticket.user] = queue
+
+    def admit(self, priority: int, requests: int, tokens: int) -> tuple:
+        """
+        Reserve budget for a unit of work (e.g. one chat request) before it starts.
+        Raises LLMOverloadedError if it would wait longer than max_wait.
+        Returns a reservation to pass to finish() when the work is done.
+        """
+        with self._cond:
+            wait = self._estimated_wait(priority)
+            if wait > self._max_wait:
+                raise LLMOverloadedError(max(1.0, wait - self._max_wait))
+            self._reserved[priority][0] += requests
+            self._reserved[priority][1] += tokens
+        return priority, requests, tokens
+
+    def finish(self, reservation: tuple):
+        """Return the budget reserved by admit()"""
+        priority, requests, tokens = reservation
+        with self._cond:
+            self._reserved[priority][0] -= requests
+            self._reserved[priority][1] -= tokens
+
+    @contextmanager
+    def admitted(self, priority: int, requests: int, tokens: int):
+        """admit() for the duration of a block"""
+        reservation = self.admit(priority, requests, tokens)
+        try:
+            yield
+        finally:
+            self.finish(reservation)
+
+    def acquire(self, tokens: int, priority: int = None, user: str = None, blocking: bool = True):
+        """
+        Wait for a slot and budget for one call of about 'tokens' tokens.
+        Returns a ticket to pass to release(), or None if blocking is False
+        and the call cannot start right away.
+        """
+        priority = _current_priority.get() if priority is None else priority
+        user = _current_user.get() if user is None else user
+        ticket = _Ticket(priority, user, tokens)
+
+        with self._cond:
+            self._queues[priority].setdefault(user, deque()).append(ticket)
+
+            while True:
+                timeout = None
+                if self._head() is ticket and self._active < self._max_concurrency:
+                    timeout = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+                    if timeout <= 0:
+                        self._remove(ticket)
+                        self._active += 1
+                        self._requests.consume(1)
+                        self._tokens.consume(tokens)
+                        self._cond.notify_all()
+                        return ticket
+                if not blocking:
+                    self._remove(ticket)
+                    self._cond.notify_all()
+                    return None
+                self._cond.wait(timeout=timeout)
+
+    def release(self, ticket, actual_tokens: int = None):
+        """Free the slot and correct the token budget with the actual usage"""
+        with self._cond:
+            self._active -= 1
+            if actual_tokens is not None:
+                self._tokens.adjust(actual_tokens - ticket.tokens)
+            self._cond.notify_all()
+
+    def run(self, fn, *, estimated_tokens: int, priority: int = None, user: str = None, **kwargs):
+        """Call an OpenAI client method under the scheduler"""
+        ticket = self.acquire(estimated_tokens, priority=priority, user=user)
+        actual_tokens = None
+        try:
+            response = fn(**kwargs)
+            actual_tokens = getattr(getattr(response, "usage", None), "total_tokens", None)
+            return response
+        finally:
+            self.release(ticket, actual_tokens)
+
+
+class SchedulerRateLimiter(BaseRateLimiter):
+    """LangChain rate limiter that admits each chat model call through the scheduler"""
+
+    def __init__(self, scheduler: LLMScheduler, estimated_tokens: int = AGENT_CALL_TOKENS_ESTIMATE):
+        self.scheduler = scheduler
+        self.estimated_tokens = estimated_tokens
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        ticket = self.scheduler.acquire(self.estimated_tokens, blocking=blocking)
+        if ticket is None:
+            return False
+        # LangChain has no release hook, so only the budget is held, not a concurrency slot
+        self.scheduler.release(ticket)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        return await asyncio.to_thread(self.acquire, blocking=blocking)
+
+
+scheduler = LLMScheduler()
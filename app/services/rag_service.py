@@ -1,21 +1,65 @@
 #rag_service.py
-from chromadb import PersistentClient
 from dotenv import load_dotenv
 import os
 from openai import OpenAI
 from langchain_openai import ChatOpenAI
 from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from app.services.index_writer import index_write_lock, rebuild_numpy_index_if_enabled
+from scripts.index_data import batch_embed
+from app.services.llm_scheduler import (
+    BATCH,
+    COMPLETION_TOKENS_ESTIMATE,
+    INTERACTIVE,
+    LLMOverloadedError,
+    SchedulerRateLimiter,
+    estimate_tokens,
+    llm_context,
+    scheduler,
+)
+from app.services.retrievers import ChromaRetriever, NumpyRetriever
 
 # -------------------- Setup --------------------
 load_dotenv()
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-client_db = PersistentClient(path="./chroma_db")
-collection = client_db.get_or_create_collection(name="company_docs")
+chroma = ChromaRetriever()
+
+# Bootstrap an empty store from a snapshot (see scripts/snapshot_index.py).
+# Taken as the single writer so only the first worker to boot imports it.
+snapshot_path = os.getenv("CHROMA_SNAPSHOT_PATH")
+if snapshot_path and chroma.collection.count() == 0:
+    from scripts.snapshot_index import import_snapshot
+    # The version is bumped only by the worker that actually imports
+    with index_write_lock(bump_version=False):
+        # Another worker may have imported while we waited: its import replaced
+        # the collection and bumped the version, so reopen before re-checking
+        chroma.refresh_if_stale()
+        if chroma.collection.count() == 0:
+            print(f"📦 Loading index snapshot from {snapshot_path}")
+            with index_write_lock():
+                chroma.collection = import_snapshot(snapshot_path, client=chroma.client)
+                rebuild_numpy_index_if_enabled()
+
+# Retrieval backend: "chroma" (default) or "numpy" (memory-mapped matrices, see retrievers.py)
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "chroma").lower()
+if RETRIEVER_BACKEND == "numpy":
+    retriever = NumpyRetriever()
+    # Rebuild a missing build, or one that missed writes made while the numpy
+    # backend was off; re-checked as the writer since another worker may have rebuilt
+    if not retriever.is_current():
+        with index_write_lock(bump_version=False):
+            retriever.refresh_if_stale()
+            if not retriever.is_current():
+                with index_write_lock():
+                    rebuild_numpy_index_if_enabled()
+        retriever.refresh_if_stale()
+else:
+    retriever = chroma
 
 # Setup LLM for CSV/Excel agents
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, rate_limiter=SchedulerRateLimiter(scheduler))
 
 # Folder where CSV/Excel files are saved (by department)
 csv_folder = "./uploaded_documents"
@@ -65,15 +109,35 @@ print("="*80 + "\n")
 # -------------------- Embedding helper --------------------
 def get_openai_embedding(text: str) -> list:
     """Generate OpenAI embedding for a text"""
-    response = client.embeddings.create(
+    response = scheduler.run(
+        client.embeddings.create,
+        estimated_tokens=estimate_tokens(text),
         input=[text],
         model="text-embedding-3-small"
     )
     return response.data[0].embedding
 
 
+# -------------------- Retrieval --------------------
+def retrieve(query_embeds: list, role: str, n_results: int = 10) -> dict:
+    """Retrieve chunks for one or more query embeddings, scoped to the role"""
+    return retriever.query(query_embeds, role, n_results=n_results)
+
+
 # -------------------- Main RAG Answer --------------------
-def rag_answer(query: str, role: str) -> str:
+def rag_answer(query: str, role: str, retrieved: dict = None, user: str = "anonymous",
+               priority: int = INTERACTIVE) -> str:
+    """
+    Answer a query for a role. 'retrieved' may hold pre-fetched Chroma results
+    for this single query ({"documents": [[...]], "metadatas": [[...]]}),
+    in which case the embedding and Chroma lookup are skipped.
+    LLM calls are scheduled under the given user and priority.
+    """
+    with llm_context(user, priority):
+        return _rag_answer(query, role, retrieved)
+
+
+def _rag_answer(query: str, role: str, retrieved: dict = None) -> str:
     role = role.lower()
     
     print("\n" + "="*80)
@@ -87,18 +151,17 @@ def rag_answer(query: str, role: str) -> str:
     # ================== STEP 1: ALWAYS QUERY CHROMA DB FIRST ==================
     print("📚 STEP 1: Querying ChromaDB for embedded documents...")
     
-    query_embed = get_openai_embedding(query)
-    
-    if role == "c-level":
-        print("   → C-Level user: Searching ALL departments")
-        results = collection.query(query_embeddings=[query_embed], n_results=10)
+    if retrieved is not None:
+        print("   → Using pre-fetched ChromaDB results")
+        results = retrieved
     else:
-        print(f"   → Department user: Searching only '{role}' department")
-        results = collection.query(
-            query_embeddings=[query_embed],
-            n_results=10,
-            where={"role": role}
-        )
+        query_embed = get_openai_embedding(query)
+
+        if role == "c-level":
+            print("   → C-Level user: Searching ALL departments")
+        else:
+            print(f"   → Department user: Searching only '{role}' department")
+        results = retrieve([query_embed], role)
     
     print(f"   → Found {len(results['documents'][0]) if results['documents'] else 0} document chunks")
     
@@ -149,7 +212,9 @@ Answer:
 """
         
         print("   → Generating answer from ChromaDB context...")
-        response = client.chat.completions.create(
+        response = scheduler.run(
+            client.chat.completions.create,
+            estimated_tokens=estimate_tokens(prompt) + COMPLETION_TOKENS_ESTIMATE,
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
@@ -197,7 +262,9 @@ User Question:
 
 Answer:
 """
-                        llm_response = client.chat.completions.create(
+                        llm_response = scheduler.run(
+                            client.chat.completions.create,
+                            estimated_tokens=estimate_tokens(csv_prompt) + COMPLETION_TOKENS_ESTIMATE,
                             model="gpt-4o-mini",
                             messages=[
                                 {"role": "system", "content": "You are a helpful assistant."},
@@ -210,6 +277,8 @@ Answer:
                         all_csv_answers.append(f"---\n📊 Data from {dept.capitalize()} Department:\n{final_ans}")
                     else:
                         print(f"      ⚠️  No useful answer from {dept}")
+                except LLMOverloadedError:
+                    raise
                 except Exception as e:
                     print(f"      ❌ Error in {dept} CSV agent: {e}")
                     all_csv_answers.append(f"❌ Error querying {dept} data: {e}")
@@ -244,7 +313,9 @@ User Question:
 
 Answer:
 """
-                llm_response = client.chat.completions.create(
+                llm_response = scheduler.run(
+                    client.chat.completions.create,
+                    estimated_tokens=estimate_tokens(csv_prompt) + COMPLETION_TOKENS_ESTIMATE,
                     model="gpt-4o-mini",
                     messages=[
                         {"role": "system", "content": "You are a helpful assistant."},
@@ -256,6 +327,8 @@ Answer:
                 return answer
             else:
                 print("   ⚠️  CSV agent couldn't find the answer")
+        except LLMOverloadedError:
+            raise
         except Exception as e:
             print(f"   ❌ Failed to run CSV/Excel agent: {e}")
     else:
@@ -266,3 +339,53 @@ Answer:
     print("\n❌ STEP 3: No answer found in either ChromaDB or CSV agents")
     print("="*80 + "\n")
     return "I'm sorry, I couldn't find relevant information based on your access level and the available data."
+
+
+# -------------------- Batch RAG Answer --------------------
+def rag_answer_batch(queries: list, role: str, max_concurrency: int = 4, user: str = "anonymous"):
+    """
+    Answer many queries for one role.
+    All queries are embedded in batched requests and looked up with a single
+    retrieval call before this returns, so those failures raise here. Returns a
+    generator that runs the generations with bounded concurrency and yields
+    (index, query, answer, error) tuples in completion order, where exactly one
+    of answer / error is None; closing it early
+    cancels the questions that have not started yet.
+    """
+    role = role.lower()
+    print(f"\n📦 BATCH QUERY: {len(queries)} questions for role '{role}'")
+    if not queries:
+        return _answer_batch([], role, [], max_concurrency, user)
+
+    with llm_context(user, BATCH):
+        query_embeds = batch_embed(queries)
+    results = retrieve(query_embeds, role)
+
+    retrieved = [
+        {
+            "documents": [results["documents"][i]] if results["documents"] else [],
+            "metadatas": [results["metadatas"][i]] if results["metadatas"] else [],
+        }
+        for i in range(len(queries))
+    ]
+    return _answer_batch(queries, role, retrieved, max_concurrency, user)
+
+
+def _answer_batch(queries: list, role: str, retrieved: list, max_concurrency: int, user: str):
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        futures = {
+            executor.submit(rag_answer, query, role, retrieved[i], user, BATCH): (i, query)
+            for i, query in enumerate(queries)
+        }
+        for future in as_completed(futures):
+            i, query = futures[future]
+            try:
+                answer, error = future.result(), None
+            except Exception as e:
+                print(f"   ❌ Batch query {i} failed: {e}")
+                answer, error = None, str(e)
+            yield i, query, answer, error
+    finally:
+        # On client disconnect the generator is closed: drop every question not yet started
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,361 @@
+#retrievers.py
+import json
+from abc import ABC, abstractmethod
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+from chromadb import PersistentClient
+
+from app.services.index_writer import get_index_version
+from scripts.snapshot_index import read_collection
+
+CHROMA_PATH = "./chroma_db"
+COLLECTION_NAME = "company_docs"
+
+# Memory-mapped NumPy backend settings
+NUMPY_INDEX_DIR = "./numpy_index"
+NUMPY_INDEX_DTYPE = os.getenv("NUMPY_INDEX_DTYPE", "float16")       # float16 | int8
+NUMPY_INDEX_IVF_LISTS = int(os.getenv("NUMPY_INDEX_IVF_LISTS", "0"))  # 0 = exact scan
+NUMPY_INDEX_NPROBE = int(os.getenv("NUMPY_INDEX_NPROBE", "8"))
+NUMPY_INDEX_FORMAT_VERSION = 1
+SCAN_BLOCK_ROWS = 4096  # rows upcast to float32 per block (~24 MiB at 1536 dims)
+KEEP_INDEX_BUILDS = 2
+
+
+class Retriever(ABC):
+    """
+    Retrieval backend used by rag_service.
+    query() takes a batch of query embeddings and returns Chroma-style results:
+    {"ids": [[...]], "documents": [[...]], "metadatas": [[...]], "distances": [[...]]}
+    with one inner list per query.
+    """
+
+    @abstractmethod
+    def query(self, query_embeds: list, role: str, n_results: int = 10) -> dict:
+        """Top n_results chunks per query embedding, scoped to the role"""
+
+
+# -------------------- Chroma backend --------------------
+class ChromaRetriever(Retriever):
+    """Query the shared ChromaDB collection, reopening it when the index version changes"""
+
+    def __init__(self, path: str = CHROMA_PATH):
+        self.path = path
+        self.client = PersistentClient(path=path)
+        self.collection = self.client.get_or_create_collection(name=COLLECTION_NAME)
+        # Index version our handles reflect; writes by any worker bump the shared version
+        self.index_version = get_index_version()
+        self._refresh_lock = threading.Lock()
+
+    def refresh_if_stale(self):
+        """Reopen the ChromaDB handle if the index was written since we opened it"""
+        current = get_index_version()
+        if current == self.index_version:
+            return
+        with self._refresh_lock:
+            if current == self.index_version:
+                return
+            print(f"🔄 Index version changed ({self.index_version} → {current}), reopening ChromaDB")
+            self.client.clear_system_cache()
+            self.client = PersistentClient(path=self.path)
+            self.collection = self.client.get_or_create_collection(name=COLLECTION_NAME)
+            self.index_version = current
+
+    def query(self, query_embeds: list, role: str, n_results: int = 10) -> dict:
+        self.refresh_if_stale()
+        if role == "c-level":
+            return self.collection.query(query_embeddings=query_embeds, n_results=n_results)
+        return self.collection.query(
+            query_embeddings=query_embeds,
+            n_results=n_results,
+            where={"role": role}
+        )
+
+
+# -------------------- NumPy backend --------------------
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so inner product equals cosine similarity"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k highest scores per row, best first"""
+    if k >= scores.shape[1]:
+        return np.argsort(-scores, axis=1)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+def _kmeans(matrix: np.ndarray, n_lists: int, iterations: int = 10, seed: int = 0) -> tuple:
+    """Spherical k-means on normalized rows; returns (centroids, assignments)"""
+    rng = np.random.default_rng(seed)
+    centroids = matrix[rng.choice(len(matrix), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(matrix @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, matrix)
+        empty = ~sums.any(axis=1)
+        sums[empty] = centroids[empty]
+        centroids = _normalize(sums)
+    return centroids, np.argmax(matrix @ centroids.T, axis=1)
+
+
+def _read_current_build(index_dir: str):
+    """Name of the build directory the CURRENT pointer refers to, or None"""
+    try:
+        with open(os.path.join(index_dir, "CURRENT"), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def build_numpy_index(collection, index_dir: str = NUMPY_INDEX_DIR, dtype: str = NUMPY_INDEX_DTYPE,
+                      ivf_lists: int = NUMPY_INDEX_IVF_LISTS, index_version: int = None) -> str:
+    """
+    Export a Chroma collection into per-role embedding matrices for NumpyRetriever.
+    Each build goes into its own directory and is published by atomically
+    rewriting the CURRENT pointer, so workers with the old files mapped keep
+    working until they reload. Call while holding the index writer role.
+    index_version is the index version the build reflects, recorded in
+    meta.json so a build that missed a write can be detected at boot.
+    Returns the build directory.
+    """
+    if dtype not in ("float16", "int8"):
+        raise ValueError(f"Unsupported NumPy index dtype: {dtype}")
+
+    ids, documents, metadatas, embeddings = read_collection(collection)
+    build_name = f"build-{time.time_ns()}"
+    build_dir = os.path.join(index_dir, build_name)
+    os.makedirs(build_dir, exist_ok=True)
+
+    if ids:
+        matrix = _normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1))
+    else:
+        matrix = np.empty((0, 0), dtype=np.float32)
+    roles = np.array([(meta or {}).get("role", "general") for meta in metadatas])
+
+    meta = {
+        "format_version": NUMPY_INDEX_FORMAT_VERSION,
+        "index_version": index_version,
+        "dtype": dtype,
+        "dimension": int(matrix.shape[1]) if len(ids) else 0,
+        "ivf_lists": {},
+        "roles": {},
+    }
+
+    for role in sorted(set(roles.tolist())):
+        rows = np.flatnonzero(roles == role)
+        role_matrix = matrix[rows]
+
+        n_lists = min(ivf_lists, len(rows))
+        if n_lists > 1:
+            centroids, assignments = _kmeans(role_matrix, n_lists)
+            order = np.argsort(assignments, kind="stable")
+            offsets = np.searchsorted(assignments[order], np.arange(n_lists + 1))
+            rows, role_matrix = rows[order], role_matrix[order]
+            np.save(os.path.join(build_dir, f"{role}.centroids.npy"), centroids.astype(np.float32))
+            np.save(os.path.join(build_dir, f"{role}.offsets.npy"), offsets.astype(np.int64))
+            meta["ivf_lists"][role] = n_lists
+
+        if dtype == "int8":
+            # Symmetric per-row quantization; scores are rescaled at query time
+            scales = np.abs(role_matrix).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            quantized = np.round(role_matrix / scales[:, None]).astype(np.int8)
+            np.save(os.path.join(build_dir, f"{role}.emb.npy"), quantized)
+            np.save(os.path.join(build_dir, f"{role}.scale.npy"), scales.astype(np.float32))
+        else:
+            np.save(os.path.join(build_dir, f"{role}.emb.npy"), role_matrix.astype(np.float16))
+
+        with open(os.path.join(build_dir, f"{role}.chunks.jsonl"), "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps({"id": ids[row], "document": documents[row], "metadata": metadatas[row]},
+                                   ensure_ascii=False) + "\n")
+        meta["roles"][role] = int(len(rows))
+
+    with open(os.path.join(build_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    tmp_path = os.path.join(index_dir, "CURRENT.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(build_name)
+    os.replace(tmp_path, os.path.join(index_dir, "CURRENT"))
+
+    # Drop old builds; files still mapped by other workers stay valid until unmapped
+    builds = sorted(name for name in os.listdir(index_dir) if name.startswith("build-"))
+    for old in builds[:-KEEP_INDEX_BUILDS]:
+        shutil.rmtree(os.path.join(index_dir, old), ignore_errors=True)
+
+    print(f"✅ Built NumPy index ({dtype}) with {len(ids)} chunks across {len(meta['roles'])} roles in {build_dir}")
+    return build_dir
+
+
+class _RoleIndex:
+    """Memory-mapped embedding matrix and chunk data for one role"""
+
+    def __init__(self, build_dir: str, role: str, ivf_lists: int):
+        self.embeddings = np.load(os.path.join(build_dir, f"{role}.emb.npy"), mmap_mode="r")
+        scale_path = os.path.join(build_dir, f"{role}.scale.npy")
+        self.scales = np.load(scale_path, mmap_mode="r") if os.path.exists(scale_path) else None
+        if ivf_lists:
+            self.centroids = np.load(os.path.join(build_dir, f"{role}.centroids.npy"))
+            self.offsets = np.load(os.path.join(build_dir, f"{role}.offsets.npy"))
+        else:
+            self.centroids = self.offsets = None
+
+        self.ids, self.documents, self.metadatas = [], [], []
+        with open(os.path.join(build_dir, f"{role}.chunks.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                self.ids.append(record["id"])
+                self.documents.append(record["document"])
+                self.metadatas.append(record["metadata"])
+
+    def _scores(self, rows, queries: np.ndarray) -> np.ndarray:
+        """Scores of the given rows against the queries, shape (len(rows), n_queries)"""
+        scores = np.asarray(self.embeddings[rows], dtype=np.float32) @ queries.T
+        if self.scales is not None:
+            scores *= np.asarray(self.scales[rows], dtype=np.float32)[:, None]
+        return scores
+
+    def _search_exact(self, queries: np.ndarray, k: int) -> tuple:
+        n_queries = len(queries)
+        best_scores = np.empty((n_queries, 0), dtype=np.float32)
+        best_rows = np.empty((n_queries, 0), dtype=np.int64)
+        for start in range(0, len(self.ids), SCAN_BLOCK_ROWS):
+            end = min(start + SCAN_BLOCK_ROWS, len(self.ids))
+            scores = np.concatenate([best_scores, self._scores(slice(start, end), queries).T], axis=1)
+            rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, end), (n_queries, end - start))], axis=1)
+            top = _top_k(scores, k)
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_rows = np.take_along_axis(rows, top, axis=1)
+        return best_scores, best_rows
+
+    def _search_ivf(self, queries: np.ndarray, k: int, nprobe: int) -> tuple:
+        probes = _top_k(queries @ self.centroids.T, nprobe)
+        all_scores, all_rows = [], []
+        for query, lists in zip(queries, probes):
+            rows = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+            scores = self._scores(rows, query[None, :])[:, 0][None, :]
+            top = _top_k(scores, k)[0]
+            all_scores.append(scores[0, top])
+            all_rows.append(rows[top])
+        # Pad ragged results so the caller can merge them as matrices
+        width = max((len(r) for r in all_rows), default=0)
+        scores_out = np.full((len(queries), width), -np.inf, dtype=np.float32)
+        rows_out = np.full((len(queries), width), -1, dtype=np.int64)
+        for i, (scores, rows) in enumerate(zip(all_scores, all_rows)):
+            scores_out[i, :len(scores)] = scores
+            rows_out[i, :len(rows)] = rows
+        return scores_out, rows_out
+
+    def search(self, queries: np.ndarray, k: int, nprobe: int) -> tuple:
+        """Top-k (scores, rows) per query; rows are -1 where fewer than k matched"""
+        if not self.ids:
+            return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+        if self.centroids is not None and nprobe < len(self.centroids):
+            return self._search_ivf(queries, k, nprobe)
+        return self._search_exact(queries, k)
+
+
+class NumpyRetriever(Retriever):
+    """
+    Exact (or IVF-partitioned) top-k search over memory-mapped per-role
+    float16/int8 embedding matrices built by build_numpy_index. The matrices
+    are shared by all workers through the page cache.
+    """
+
+    def __init__(self, index_dir: str = NUMPY_INDEX_DIR, nprobe: int = NUMPY_INDEX_NPROBE):
+        self.index_dir = index_dir
+        self.nprobe = nprobe
+        self.build = None
+        self.build_version = None
+        self.roles = {}
+        self.index_version = get_index_version()
+        self._refresh_lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        build = _read_current_build(self.index_dir)
+        if build is None:
+            print(f"⚠️  No NumPy index found in {self.index_dir}")
+            self.build, self.build_version, self.roles = None, None, {}
+            return
+        build_dir = os.path.join(self.index_dir, build)
+        with open(os.path.join(build_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format_version") != NUMPY_INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported NumPy index format version {meta.get('format_version')}")
+        self.roles = {
+            role: _RoleIndex(build_dir, role, meta["ivf_lists"].get(role, 0))
+            for role in meta["roles"]
+        }
+        self.build = build
+        # Index version the build was made from (None for builds without one)
+        self.build_version = meta.get("index_version")
+        print(f"📐 Loaded NumPy index {build} ({meta['dtype']}, {sum(meta['roles'].values())} chunks)")
+
+    def is_empty(self) -> bool:
+        return self.build is None
+
+    def is_current(self) -> bool:
+        """True if the loaded build reflects the latest write to the index"""
+        return self.build is not None and self.build_version == get_index_version()
+
+    def refresh_if_stale(self):
+        """Map the latest build if the index was written since we loaded it"""
+        current = get_index_version()
+        if current == self.index_version:
+            return
+        with self._refresh_lock:
+            if current == self.index_version:
+                return
+            if _read_current_build(self.index_dir) != self.build:
+                self._load()
+            self.index_version = current
+
+    def query(self, query_embeds: list, role: str, n_results: int = 10) -> dict:
+        self.refresh_if_stale()
+        queries = _normalize(np.asarray(query_embeds, dtype=np.float32).reshape(len(query_embeds), -1))
+        # Bind the build once: a concurrent refresh may swap self.roles mid-query
+        role_indexes = self.roles
+        roles = list(role_indexes) if role == "c-level" else [r for r in role_indexes if r == role]
+
+        # Search each role and merge the per-role top-k into a global top-k
+        merged_scores, merged_refs = [], []
+        for role_index, role_name in enumerate(roles):
+            scores, rows = role_indexes[role_name].search(queries, n_results, self.nprobe)
+            merged_scores.append(scores)
+            merged_refs.append(np.where(rows >= 0, rows * len(roles) + role_index, -1))
+        if merged_scores:
+            scores = np.concatenate(merged_scores, axis=1)
+            refs = np.concatenate(merged_refs, axis=1)
+            top = _top_k(scores, n_results)
+            scores = np.take_along_axis(scores, top, axis=1)
+            refs = np.take_along_axis(refs, top, axis=1)
+        else:
+            scores = refs = np.empty((len(queries), 0))
+
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query_scores, query_refs in zip(scores, refs):
+            ids, documents, metadatas, distances = [], [], [], []
+            for score, ref in zip(query_scores, query_refs):
+                if ref < 0:
+                    continue
+                role_index = role_indexes[roles[int(ref) % len(roles)]]
+                row = int(ref) // len(roles)
+                ids.append(role_index.ids[row])
+                documents.append(role_index.documents[row])
+                metadatas.append(role_index.metadatas[row])
+                distances.append(float(1.0 - score))
+            results["ids"].append(ids)
+            results["documents"].append(documents)
+            results["metadatas"].append(metadatas)
+            results["distances"].append(distances)
+        return results
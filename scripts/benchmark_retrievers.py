@@ -0,0 +1,103 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from app.services.retrievers import ChromaRetriever, NumpyRetriever, build_numpy_index
+from scripts.snapshot_index import read_collection
+
+# Usage: python -m scripts.benchmark_retrievers --queries 200 --role c-level
+#
+# Compares recall@k and per-query latency of the Chroma path against the
+# memory-mapped NumPy backend (float16, int8 and float16 + IVF). Queries are
+# stored chunk embeddings with a little noise added, so no OpenAI calls are made;
+# ground truth is an exact float32 search over the role's chunks.
+
+
+def make_queries(matrix, n_queries, noise, seed=0):
+    """Perturbed copies of random stored embeddings, L2-normalized"""
+    rng = np.random.default_rng(seed)
+    picks = matrix[rng.choice(len(matrix), n_queries, replace=len(matrix) < n_queries)]
+    queries = picks + rng.normal(scale=noise, size=picks.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_ids(matrix, ids, queries, k):
+    """Ground-truth top-k ids per query using float32 inner product"""
+    normalized = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    scores = queries @ normalized.T
+    top = np.argsort(-scores, axis=1)[:, :k]
+    return [[ids[i] for i in row] for row in top]
+
+
+def run(name, retriever, queries, role, k, truth):
+    """Time single-query lookups and measure recall@k against the exact result"""
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        results = retriever.query([query.tolist()], role, n_results=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(results["ids"][0]) & set(expected)) / max(len(expected), 1))
+
+    start = time.perf_counter()
+    retriever.query(queries.tolist(), role, n_results=k)
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{name:<22} recall@{k}={np.mean(recalls):.3f}  "
+          f"p50={np.percentile(latencies, 50):7.2f} ms  p95={np.percentile(latencies, 95):7.2f} ms  "
+          f"batch({len(queries)})={batch_ms:8.1f} ms")
+
+
+def dir_size_mb(path):
+    return sum(
+        os.path.getsize(os.path.join(dirpath, f)) for dirpath, _, files in os.walk(path) for f in files
+    ) / (1024 * 1024)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Chroma vs NumPy retrieval")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--role", default="c-level")
+    parser.add_argument("--noise", type=float, default=0.02)
+    parser.add_argument("--ivf-lists", type=int, default=0, help="IVF lists per role (default: sqrt of role size)")
+    parser.add_argument("--nprobe", type=int, default=8)
+    args = parser.parse_args()
+
+    chroma = ChromaRetriever()
+    ids, documents, metadatas, embeddings = read_collection(chroma.collection)
+    if not ids:
+        raise SystemExit("Collection is empty; index some documents first")
+
+    matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+    if args.role != "c-level":
+        in_role = np.array([(meta or {}).get("role") == args.role for meta in metadatas])
+        matrix = matrix[in_role]
+        ids = [i for i, keep in zip(ids, in_role) if keep]
+        if not ids:
+            raise SystemExit(f"No chunks for role '{args.role}'")
+
+    queries = make_queries(matrix, args.queries, args.noise)
+    truth = exact_ids(matrix, ids, queries, args.k)
+    ivf_lists = args.ivf_lists or max(2, int(np.sqrt(len(ids))))
+    print(f"{len(ids)} chunks, dim={matrix.shape[1]}, {len(queries)} queries, role={args.role}\n")
+
+    run("chroma", chroma, queries, args.role, args.k, truth)
+
+    variants = [
+        ("numpy float16", "float16", 0),
+        ("numpy int8", "int8", 0),
+        (f"numpy float16 ivf{ivf_lists}", "float16", ivf_lists),
+    ]
+    for name, dtype, lists in variants:
+        index_dir = tempfile.mkdtemp(prefix="numpy_index_")
+        try:
+            build_numpy_index(chroma.collection, index_dir=index_dir, dtype=dtype, ivf_lists=lists)
+            retriever = NumpyRetriever(index_dir=index_dir, nprobe=args.nprobe)
+            run(name, retriever, queries, args.role, args.k, truth)
+            print(f"{'':<22} on-disk size={dir_size_mb(index_dir):.1f} MiB")
+        finally:
+            shutil.rmtree(index_dir, ignore_errors=True)
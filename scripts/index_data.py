@@ -7,6 +7,7 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from pathlib import Path
 from openai import OpenAI
 from dotenv import load_dotenv
+from app.services.llm_scheduler import BACKGROUND, estimate_tokens, llm_context, scheduler
 
 load_dotenv()
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
@@ -29,8 +30,10 @@ def get_role_from_path(filepath, base_dir):
         return "general"
 
 def get_openai_embeddings(texts):
-    """Generate embeddings using OpenAI"""
-    response = client.embeddings.create(
+    """Generate embeddings using OpenAI, scheduled under the caller's llm_context"""
+    response = scheduler.run(
+        client.embeddings.create,
+        estimated_tokens=estimate_tokens(*texts),
         input=texts,
         model="text-embedding-3-small"
     )
@@ -45,12 +48,16 @@ def batch_embed(texts, batch_size=100):
         embeddings.extend(emb)
     return embeddings
 
-def index_documents(docs_dir):
+def index_documents(docs_dir, md_files=None):
     """
     Index all markdown documents from the specified directory
     Documents are organized by department folders
+    If md_files is given, only those files (under docs_dir) are indexed
+    This writes to ./chroma_db; from the API go through
+    app.services.index_writer.submit_indexing so only one worker writes at a time
     """
-    md_files = glob.glob(os.path.join(docs_dir, "**/*.md"), recursive=True)
+    if md_files is None:
+        md_files = glob.glob(os.path.join(docs_dir, "**/*.md"), recursive=True)
 
     if not md_files:
         print("No markdown files found to index")
@@ -60,6 +67,8 @@ def index_documents(docs_dir):
 
     all_chunks = []
     metadata = []
+    ids = []
+    sources = set()
 
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=500,
@@ -69,15 +78,23 @@ def index_documents(docs_dir):
     for md_file in md_files:
         role = get_role_from_path(md_file, docs_dir)
         text = md_to_text(md_file)
+        # Path relative to docs_dir, so same-named files in different folders stay apart
+        source = Path(os.path.relpath(md_file, docs_dir)).as_posix()
         chunks = text_splitter.split_text(text)
+        sources.add(source)
 
+        chunk_index = 0
         for chunk in chunks:
             chunk = chunk.strip()
             if len(chunk) > 20:
+                # Ids are derived from the document, not the collection size, so
+                # re-indexing a file replaces its chunks instead of duplicating them
+                ids.append(f"{source}#{chunk_index}")
+                chunk_index += 1
                 all_chunks.append(chunk)
                 metadata.append({
                     "role": role,
-                    "source": os.path.basename(md_file)
+                    "source": source
                 })
 
     if not all_chunks:
@@ -87,19 +104,23 @@ def index_documents(docs_dir):
     print(f"Generated {len(all_chunks)} chunks from documents")
     print("Generating embeddings...")
 
-    embeddings = batch_embed(all_chunks)
+    with llm_context("indexer", BACKGROUND):
+        embeddings = batch_embed(all_chunks)
 
     chroma_client = PersistentClient(path="./chroma_db")
     collection = chroma_client.get_or_create_collection(name="company_docs")
 
-    existing_count = collection.count()
-    print(f"Collection has {existing_count} existing documents")
+    print(f"Collection has {collection.count()} existing documents")
 
-    collection.add(
+    # Drop previous chunks of the re-indexed documents so shrunk files leave no stale tail
+    for source in sources:
+        collection.delete(where={"source": source})
+
+    collection.upsert(
         embeddings=embeddings,
         documents=all_chunks,
         metadatas=metadata,
-        ids=[f"doc_{existing_count + i}" for i in range(len(all_chunks))]
+        ids=ids
     )
 
     print(f"Successfully indexed {len(all_chunks)} chunks")
@@ -0,0 +1,203 @@
+import argparse
+import io
+import json
+import os
+import tarfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from chromadb import PersistentClient
+
+from app.services.index_writer import index_write_lock, rebuild_numpy_index_if_enabled
+from app.services.ingestion import MANIFEST_PATH
+
+# Usage: python -m scripts.snapshot_index export snapshot.tar.gz
+#        python -m scripts.snapshot_index import snapshot.tar.gz
+
+CHROMA_PATH = "./chroma_db"
+COLLECTION_NAME = "company_docs"
+TABLES_DIR = "./uploaded_documents"
+TABLE_EXTENSIONS = (".csv", ".xlsx", ".xls")
+
+SNAPSHOT_FORMAT_VERSION = 1
+EMBEDDING_MODEL = "text-embedding-3-small"
+EXPORT_PAGE_SIZE = 1000
+STAGING_SUFFIX = "_import"
+
+
+def _add_bytes(tar, name, data):
+    """Add an in-memory file to a tar archive"""
+    info = tarfile.TarInfo(name=name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def read_collection(collection):
+    """Read every record of a collection page by page"""
+    ids, documents, metadatas, embeddings = [], [], [], []
+    total = collection.count()
+    for offset in range(0, total, EXPORT_PAGE_SIZE):
+        page = collection.get(
+            limit=EXPORT_PAGE_SIZE,
+            offset=offset,
+            include=["embeddings", "documents", "metadatas"]
+        )
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+        embeddings.extend(page["embeddings"])
+    return ids, documents, metadatas, embeddings
+
+
+def export_snapshot(output_path, chroma_path=CHROMA_PATH):
+    """
+    Export the indexed collection to a versioned, gzip-compressed snapshot.
+    The bundle contains chunk ids/documents/metadata, the embedding matrix,
+    the ingestion manifest and the CSV/Excel tables used by the Pandas agents.
+    Everything is read while holding the index writer role, which uploads also
+    take to publish files and manifest entries, so the bundle is consistent.
+    """
+    client = PersistentClient(path=chroma_path)
+    collection = client.get_or_create_collection(name=COLLECTION_NAME)
+
+    with index_write_lock(bump_version=False):
+        ids, documents, metadatas, embeddings = read_collection(collection)
+
+        if ids:
+            matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        else:
+            matrix = np.empty((0, 0), dtype=np.float32)
+
+        meta = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "collection": COLLECTION_NAME,
+            "embedding_model": EMBEDDING_MODEL,
+            "count": len(ids),
+            "dimension": int(matrix.shape[1]) if len(ids) else 0,
+            "tables": [],
+        }
+
+        with tarfile.open(output_path, "w:gz") as tar:
+            records = "\n".join(
+                json.dumps({"id": i, "document": d, "metadata": m}, ensure_ascii=False)
+                for i, d, m in zip(ids, documents, metadatas)
+            )
+            _add_bytes(tar, "chunks.jsonl", records.encode("utf-8"))
+
+            buf = io.BytesIO()
+            np.save(buf, matrix)
+            _add_bytes(tar, "embeddings.npy", buf.getvalue())
+
+            if os.path.exists(MANIFEST_PATH):
+                tar.add(MANIFEST_PATH, arcname="ingestion_manifest.json")
+
+            for dirpath, _, filenames in os.walk(TABLES_DIR):
+                for file in filenames:
+                    if file.endswith(TABLE_EXTENSIONS):
+                        full_path = os.path.join(dirpath, file)
+                        rel_path = os.path.relpath(full_path, TABLES_DIR).replace(os.sep, "/")
+                        tar.add(full_path, arcname=f"tables/{rel_path}")
+                        meta["tables"].append(rel_path)
+
+            _add_bytes(tar, "snapshot.json", json.dumps(meta, indent=2).encode("utf-8"))
+
+    print(f"✅ Exported {meta['count']} chunks and {len(meta['tables'])} tables to {output_path}")
+    return meta
+
+
+def import_snapshot(snapshot_path, chroma_path=CHROMA_PATH, client=None):
+    """
+    Replace the collection with the contents of a snapshot using bulk inserts,
+    and restore the ingestion manifest and CSV/Excel tables.
+    Pass an existing client to load into an already-open store.
+    Chunks are loaded into a staging collection that is swapped in at the end,
+    but workers still holding the old collection fail their queries until they
+    see the version bump, so this is meant for new nodes or a maintenance window.
+    Call while holding index_write_lock.
+    """
+    with tarfile.open(snapshot_path, "r:gz") as tar:
+        meta = json.load(tar.extractfile("snapshot.json"))
+        if meta.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported snapshot format version {meta.get('format_version')} "
+                f"(expected {SNAPSHOT_FORMAT_VERSION})"
+            )
+
+        records = [
+            json.loads(line)
+            for line in tar.extractfile("chunks.jsonl").read().decode("utf-8").splitlines()
+            if line
+        ]
+        matrix = np.load(io.BytesIO(tar.extractfile("embeddings.npy").read()))
+        if len(records) != meta["count"] or matrix.shape[0] != meta["count"]:
+            raise ValueError("Snapshot is inconsistent: chunk and embedding counts do not match")
+
+        if client is None:
+            client = PersistentClient(path=chroma_path)
+        staging_name = COLLECTION_NAME + STAGING_SUFFIX
+        try:
+            client.delete_collection(name=staging_name)
+        except Exception:
+            pass
+        collection = client.create_collection(name=staging_name)
+
+        batch_size = client.get_max_batch_size() if hasattr(client, "get_max_batch_size") else 5000
+        for start in range(0, len(records), batch_size):
+            batch = records[start:start + batch_size]
+            collection.add(
+                ids=[r["id"] for r in batch],
+                documents=[r["document"] for r in batch],
+                metadatas=[r["metadata"] for r in batch],
+                embeddings=matrix[start:start + batch_size]
+            )
+
+        # Swap the fully loaded collection in
+        try:
+            client.delete_collection(name=COLLECTION_NAME)
+        except Exception:
+            pass
+        collection.modify(name=COLLECTION_NAME)
+
+        names = tar.getnames()
+        if "ingestion_manifest.json" in names:
+            with open(MANIFEST_PATH, "wb") as f:
+                f.write(tar.extractfile("ingestion_manifest.json").read())
+
+        for rel_path in meta.get("tables", []):
+            dest = os.path.join(TABLES_DIR, *rel_path.split("/"))
+            if os.path.commonpath([os.path.abspath(dest), os.path.abspath(TABLES_DIR)]) != os.path.abspath(TABLES_DIR):
+                print(f"⚠️  Skipping table outside {TABLES_DIR}: {rel_path}")
+                continue
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(dest, "wb") as f:
+                f.write(tar.extractfile(f"tables/{rel_path}").read())
+
+    print(f"✅ Imported {collection.count()} chunks and {len(meta.get('tables', []))} tables from {snapshot_path}")
+    return collection
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or import a ChromaDB index snapshot")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export the index to a snapshot file")
+    export_parser.add_argument("output", help="Path of the .tar.gz snapshot to write")
+    export_parser.add_argument("--chroma-path", default=CHROMA_PATH)
+
+    import_parser = subparsers.add_parser(
+        "import", help="Load a snapshot file into the index (new nodes or maintenance windows)"
+    )
+    import_parser.add_argument("snapshot", help="Path of the .tar.gz snapshot to read")
+    import_parser.add_argument("--chroma-path", default=CHROMA_PATH)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export_snapshot(args.output, chroma_path=args.chroma_path)
+    else:
+        # Take the writer role so running API workers see the import as a new version
+        with index_write_lock():
+            import_snapshot(args.snapshot, chroma_path=args.chroma_path)
+            rebuild_numpy_index_if_enabled()